@@ -9,6 +9,7 @@ from sklearn.metrics import r2_score, mean_squared_error
 import cvxpy as cp
 from pykalman import KalmanFilter
 from datetime import datetime, timedelta
+import regimes
 
 # --- Flask App Setup ---
 app = Flask(__name__)
@@ -32,6 +33,9 @@ GLOBAL_TIMES = None             # Full pandas DatetimeIndex
 GLOBAL_Y_TRUE_LOGRET = None     # Full np.array of true log returns
 GLOBAL_YHAT_KALMAN_LOGRET = None  # Full np.array of predicted log returns
 
+# --- Globals for HMM regime trackers (one per asset) ---
+REGIME_TRACKERS = {}
+
 # --- File paths and Configs (from your notebook) ---
 FILE_MAP = {
     "silver": "./silver.csv",   # TARGET
@@ -252,6 +256,21 @@ def load_all_models():
 
     print("\n--- All models loaded. Server is ready. ---")
 
+def load_regime_models():
+    """
+    Loads (or fits once and caches) the HMM regime model for every asset.
+    Runs independently of load_data() so regimes are served even if one CSV is missing.
+    """
+    for k, fname in FILE_MAP.items():
+        if not os.path.exists(fname):
+            print(f"Skipping regime model for {k}: missing file {fname}.")
+            continue
+        try:
+            REGIME_TRACKERS[k] = regimes.load_or_fit(k, read_price_series(fname))
+            print(f"Regime model ready for {k} (last date {REGIME_TRACKERS[k].last_date:%Y-%m-%d}).")
+        except Exception as e:
+            print(f"Error loading regime model for {k}: {e}")
+
 
 # --- API Endpoints (The "Connection" Points) ---
 
@@ -349,6 +368,51 @@ def api_performance_metrics():
         return jsonify({"error": "Metrics not loaded."}), 500
     return jsonify(KALMAN_METRICS)
 
+@app.route("/api/regimes/<asset>")
+def api_regimes(asset):
+    """
+    Returns the current filtered regime and the cached regime history
+    for an asset, optionally sliced by 'start' / 'end' (YYYY-MM-DD; empty = open).
+    Each row's 'source' is "viterbi" (decoded at fit time) or "filtered" (added online).
+    """
+    tracker = REGIME_TRACKERS.get(asset.lower())
+    if tracker is None:
+        return jsonify({"error": f"No regime model loaded for '{asset}'."}), 404
+
+    try:
+        history = tracker.history(request.args.get('start'), request.args.get('end'))
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": f"Invalid date range: {e}"}), 400
+
+    return jsonify({
+        "asset": tracker.asset,
+        "current": tracker.current(),
+        "history": history,
+        "model": tracker.model_summary(),
+    })
+
+@app.route("/api/regimes/<asset>/observe", methods=["POST"])
+def api_regimes_observe(asset):
+    """
+    Folds one new price into the asset's regime filter (O(1), no refit).
+    Expects JSON: {"date": "YYYY-MM-DD", "price": float}.
+    Observations are kept in memory only and are lost on restart; the asset's
+    CSV is the source of truth and is re-filtered from the cache at startup.
+    """
+    tracker = REGIME_TRACKERS.get(asset.lower())
+    if tracker is None:
+        return jsonify({"error": f"No regime model loaded for '{asset}'."}), 404
+
+    body = request.get_json(silent=True) or {}
+    if "date" not in body or "price" not in body:
+        return jsonify({"error": "Body must contain 'date' and 'price'."}), 400
+
+    try:
+        current = tracker.update(body["date"], body["price"])
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(current)
+
 # --- NEW: Endpoint for Live Commodity Prices ---
 @app.route("/api/commodity_prices")
 def api_commodity_prices():
@@ -392,5 +456,6 @@ def api_commodity_prices():
 if __name__ == "__main__":
     # Run all models ONCE on startup
     load_all_models()
+    load_regime_models()
     # Start the Flask server
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,346 @@
+import os
+import json
+import numbers
+import threading
+import numpy as np
+import pandas as pd
+from hmmlearn.hmm import GaussianHMM
+
+# --- Regime Model Config (from silver_prediction.ipynb, Cell 6) ---
+N_REGIMES = 3
+HMM_N_ITER = 200
+HMM_N_RESTARTS = 10
+HMM_RANDOM_STATE = 42
+# Sticky transition init: EM from a uniform transmat tends to converge to
+# states that flip every day with near-identical variances
+HMM_STAY_PROB = 0.925
+# Volatility-spread init (variances as multiples of the sample variance), tried
+# alongside k-means init on every restart: on copper k-means init always collapses a state
+HMM_VAR_SPREAD = [0.3, 1.0, 4.0]
+# Restarts with an empty or runaway state are discarded before comparing scores
+HMM_MIN_OCCUPANCY = 0.005
+HMM_MAX_VAR_RATIO = 100.0
+STATE_ORDER = "variance"
+REGIME_DIR = "./regime_models"
+
+# States are relabelled by ascending variance to keep labels stable across refits
+REGIME_LABELS = ["Low Volatility", "Medium Volatility", "High Volatility"]
+
+# Any change here invalidates cached regime_models/*.npz files
+MODEL_CONFIG = {
+    "n_regimes": N_REGIMES,
+    "n_iter": HMM_N_ITER,
+    "n_restarts": HMM_N_RESTARTS,
+    "random_state": HMM_RANDOM_STATE,
+    "stay_prob": HMM_STAY_PROB,
+    "var_spread": HMM_VAR_SPREAD,
+    "min_occupancy": HMM_MIN_OCCUPANCY,
+    "max_var_ratio": HMM_MAX_VAR_RATIO,
+    "state_order": STATE_ORDER,
+    "history_sources": True,
+}
+
+# Per-row origin of a cached regime: decoded over the full fit, or filtered online
+SOURCE_VITERBI = "viterbi"
+SOURCE_FILTERED = "filtered"
+
+
+# --- Helper Functions ---
+
+def log_emission(x, means, variances):
+    """
+    Log density of a scalar observation under each regime's Gaussian.
+    """
+    return -0.5 * (np.log(2.0 * np.pi * variances) + (x - means) ** 2 / variances)
+
+def forward_step(prior, x, means, variances):
+    """
+    One step of the scaled forward recursion. `prior` is the predicted regime
+    distribution (startprob for the first observation, alpha_prev @ transmat after).
+    Returns the normalised filtered probabilities and the log of the scale factor.
+    """
+    # Work in log space so extreme returns can't underflow every state to zero
+    with np.errstate(divide="ignore"):
+        log_alpha = np.log(prior) + log_emission(x, means, variances)
+    shift = log_alpha.max()
+    if not np.isfinite(shift):
+        # Observation carries no usable information: keep the prediction
+        return prior / prior.sum(), 0.0
+    alpha = np.exp(log_alpha - shift)
+    scale = alpha.sum()
+    return alpha / scale, np.log(scale) + shift
+
+def forward_filter(obs, startprob, transmat, means, variances):
+    """
+    Runs the scaled forward recursion over a full series.
+    Returns (T x K) filtered probabilities and the total log-likelihood.
+    """
+    filtered = np.empty((len(obs), len(means)))
+    prior, loglik = startprob, 0.0
+    for t, x in enumerate(obs):
+        alpha, log_c = forward_step(prior, x, means, variances)
+        prior = alpha @ transmat
+        filtered[t] = alpha
+        loglik += log_c
+    return filtered, loglik
+
+def is_degenerate(hmm, X, sample_var):
+    """
+    True if any state is effectively unused or its variance has run away,
+    i.e. the fit has fewer live regimes than it reports.
+    """
+    variances = np.diagonal(hmm.covars_, axis1=1, axis2=2)[:, 0]
+    viterbi_days = np.bincount(hmm.predict(X), minlength=N_REGIMES)
+    occupancy = hmm.predict_proba(X).mean(axis=0)
+    return (viterbi_days.min() == 0
+            or occupancy.min() < HMM_MIN_OCCUPANCY
+            or variances.max() > HMM_MAX_VAR_RATIO * sample_var)
+
+def fit_hmm(obs, asset=""):
+    """
+    Fits the Gaussian HMM offline from a sticky transition init, keeping the
+    best non-degenerate restart by log-likelihood, and relabels states by
+    ascending variance. Returns the parameters and the decoded (Viterbi) states.
+    """
+    X = obs.reshape(-1, 1)
+    sample_var = obs.var()
+    sticky = HMM_STAY_PROB * np.eye(N_REGIMES) + (1.0 - HMM_STAY_PROB) / N_REGIMES
+
+    hmm, best_score, n_degenerate = None, -np.inf, 0
+    for i in range(HMM_N_RESTARTS):
+        seed = HMM_RANDOM_STATE + i
+        for init in ("kmeans", "spread"):
+            candidate = GaussianHMM(n_components=N_REGIMES, covariance_type="diag",
+                                    n_iter=HMM_N_ITER, random_state=seed,
+                                    init_params="smc" if init == "kmeans" else "s")
+            candidate.transmat_ = sticky.copy()
+            if init == "spread":
+                jitter = np.exp(np.random.RandomState(seed).uniform(-0.3, 0.3, N_REGIMES))
+                candidate.means_ = np.full((N_REGIMES, 1), obs.mean())
+                candidate.covars_ = (sample_var * np.array(HMM_VAR_SPREAD) * jitter)[:, None]
+            candidate.fit(X)
+            score = candidate.score(X)
+            if not np.isfinite(score) or is_degenerate(candidate, X, sample_var):
+                n_degenerate += 1
+                continue
+            if score > best_score:
+                hmm, best_score = candidate, score
+
+    if hmm is None:
+        raise RuntimeError(f"HMM fit failed for {asset}: every restart was degenerate or non-finite.")
+    if n_degenerate:
+        print(f"HMM fit for {asset}: discarded {n_degenerate} degenerate restarts.")
+    print(f"HMM fit for {asset}: log-likelihood {best_score:.2f}, "
+          f"converged={hmm.monitor_.converged} after {hmm.monitor_.iter} iterations.")
+    states = hmm.predict(X)
+
+    means = hmm.means_[:, 0]
+    variances = np.diagonal(hmm.covars_, axis1=1, axis2=2)[:, 0]
+    order = np.argsort(variances)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+
+    params = {
+        "startprob": hmm.startprob_[order],
+        "transmat": hmm.transmat_[np.ix_(order, order)],
+        "means": means[order],
+        "variances": variances[order],
+    }
+    return params, rank[states]
+
+
+# --- Regime Tracker ---
+
+class RegimeTracker:
+    """
+    Holds one asset's fitted HMM, its cached state history and the current
+    filtered regime probabilities. New prices are folded in with a single
+    forward step, so live updates never re-run EM or decode the full history.
+    """
+
+    def __init__(self, asset, params, dates, states, sources, filtered, last_price, fingerprint):
+        self.asset = asset
+        self.fingerprint = fingerprint
+        self.startprob = params["startprob"]
+        self.transmat = params["transmat"]
+        self.means = params["means"]
+        self.variances = params["variances"]
+        self.dates = list(pd.to_datetime(dates))
+        self.states = list(states)
+        self.sources = [str(src) for src in sources]
+        self.filtered = [row for row in filtered]
+        self.last_price = float(last_price)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def fit(cls, asset, px_df, price_col="Price"):
+        """
+        Fits the HMM on the asset's log returns and filters the full history once.
+        """
+        ret = np.log(px_df[price_col] / px_df[price_col].shift(1)).dropna()
+        obs = ret.values
+        params, states = fit_hmm(obs, asset)
+        filtered, _ = forward_filter(obs, params["startprob"], params["transmat"],
+                                     params["means"], params["variances"])
+        last_price = float(px_df[price_col].iloc[-1])
+        fingerprint = dict(MODEL_CONFIG,
+                           fit_last_date=px_df.index[-1].strftime("%Y-%m-%d"),
+                           fit_last_price=last_price)
+        sources = [SOURCE_VITERBI] * len(states)
+        return cls(asset, params, ret.index, states, sources, filtered, last_price, fingerprint)
+
+    @classmethod
+    def load(cls, path, asset):
+        with np.load(path) as f:
+            params = {k: f[k] for k in ("startprob", "transmat", "means", "variances")}
+            fingerprint = json.loads(str(f["fingerprint"])) if "fingerprint" in f else {}
+            # Caches without per-row sources predate history_sources and fail is_valid_for
+            sources = f["sources"] if "sources" in f else [SOURCE_VITERBI] * len(f["states"])
+            return cls(asset, params, f["dates"], f["states"], sources, f["filtered"],
+                       f["last_price"], fingerprint)
+
+    def save(self, path):
+        with self._lock:
+            np.savez(
+                path,
+                startprob=self.startprob, transmat=self.transmat,
+                means=self.means, variances=self.variances,
+                dates=np.array([d.strftime("%Y-%m-%d") for d in self.dates]),
+                states=np.array(self.states), sources=np.array(self.sources),
+                filtered=np.array(self.filtered),
+                last_price=self.last_price,
+                fingerprint=json.dumps(self.fingerprint),
+            )
+
+    @property
+    def last_date(self):
+        return self.dates[-1]
+
+    def is_valid_for(self, px_df, price_col="Price"):
+        """
+        Checks the cache was built with the current MODEL_CONFIG and that the
+        prices it was fitted on (and last filtered) still match the CSV.
+        """
+        fp = self.fingerprint
+        if any(fp.get(k) != v for k, v in MODEL_CONFIG.items()):
+            return False
+        px = px_df[price_col]
+        checkpoints = [
+            (pd.to_datetime(fp.get("fit_last_date")), fp.get("fit_last_price")),
+            (self.last_date, self.last_price),
+        ]
+        for date, price in checkpoints:
+            if price is None or pd.isna(date) or date not in px.index:
+                return False
+            if not np.isclose(px.loc[date], price):
+                return False
+        return True
+
+    def update(self, date, price):
+        """
+        Advances the filtered regime probabilities by one new price in O(1).
+        The appended state is the filtered MAP regime (source "filtered"),
+        not a Viterbi re-decode.
+        """
+        if isinstance(price, bool) or not isinstance(price, numbers.Real):
+            raise ValueError("Price must be a number.")
+        price = float(price)
+        if not np.isfinite(price) or price <= 0:
+            raise ValueError("Price must be a positive finite number.")
+        date = pd.to_datetime(date)
+        if pd.isna(date):
+            raise ValueError("Observation date is missing or invalid.")
+
+        with self._lock:
+            if date <= self.dates[-1]:
+                raise ValueError(f"Observation date must be after {self.dates[-1]:%Y-%m-%d}.")
+            x = np.log(price / self.last_price)
+            alpha, _ = forward_step(self.filtered[-1] @ self.transmat, x, self.means, self.variances)
+            state = int(np.argmax(alpha))
+            # Build the response before mutating so a failure leaves the tracker untouched
+            row = self._format_row(date, state, SOURCE_FILTERED, alpha)
+            self.dates.append(date)
+            self.states.append(state)
+            self.sources.append(SOURCE_FILTERED)
+            self.filtered.append(alpha)
+            self.last_price = price
+            return row
+
+    def current(self):
+        with self._lock:
+            return self._row(-1)
+
+    def history(self, start=None, end=None):
+        """
+        Returns the cached regimes between start and end (inclusive).
+        None or "" leaves that side of the range open.
+        """
+        start, end = parse_bound(start, "start"), parse_bound(end, "end")
+        with self._lock:
+            idx = pd.DatetimeIndex(self.dates)
+            lo = 0 if start is None else idx.searchsorted(start, side="left")
+            hi = len(idx) if end is None else idx.searchsorted(end, side="right")
+            return [self._row(i) for i in range(lo, hi)]
+
+    def model_summary(self):
+        return {
+            "labels": REGIME_LABELS,
+            "means": self.means.tolist(),
+            "variances": self.variances.tolist(),
+            "transmat": self.transmat.tolist(),
+        }
+
+    def _row(self, i):
+        return self._format_row(self.dates[i], int(self.states[i]), self.sources[i], self.filtered[i])
+
+    @staticmethod
+    def _format_row(date, state, source, probs):
+        return {
+            "date": date.strftime("%Y-%m-%d"),
+            "state": state,
+            "label": REGIME_LABELS[state],
+            "source": source,
+            "probabilities": np.asarray(probs).tolist(),
+        }
+
+
+def parse_bound(value, name):
+    """
+    Parses an optional date-range bound; raises ValueError if it isn't a date.
+    """
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    date = pd.to_datetime(value)
+    if pd.isna(date):
+        raise ValueError(f"'{name}' is not a valid date.")
+    return date
+
+
+# --- Loading ---
+
+def load_or_fit(asset, px_df, regime_dir=REGIME_DIR, price_col="Price"):
+    """
+    Loads the cached HMM for an asset, or fits and persists it if missing or
+    stale (config changed or the CSV no longer matches the cached prices).
+    Any prices newer than the cache are folded in with online forward steps
+    and kept with source "filtered" until the next refit re-decodes them.
+    """
+    os.makedirs(regime_dir, exist_ok=True)
+    path = os.path.join(regime_dir, f"{asset}_hmm.npz")
+
+    tracker = RegimeTracker.load(path, asset) if os.path.exists(path) else None
+    if tracker is not None and not tracker.is_valid_for(px_df, price_col=price_col):
+        print(f"Cached regime model for {asset} is stale. Refitting.")
+        tracker = None
+
+    if tracker is not None:
+        new_px = px_df.loc[px_df.index > tracker.last_date, price_col]
+        for date, price in new_px.items():
+            tracker.update(date, price)
+        if len(new_px) > 0:
+            tracker.save(path)
+        return tracker
+
+    tracker = RegimeTracker.fit(asset, px_df, price_col=price_col)
+    tracker.save(path)
+    return tracker